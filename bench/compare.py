@@ -0,0 +1,40 @@
+"""Compare two benchmark reports written by bench.run.
+
+    python -m bench.compare baseline.json candidate.json
+"""
+import argparse
+import json
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+
+    print(f"baseline {baseline.get('revision')}  vs  candidate {candidate.get('revision')}")
+    print(f"{'scenario':15} {'metric':12} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for name, after in candidate["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        rows = [("rps", before["throughput_rps"], after["throughput_rps"])]
+        rows += [(f"{p} ms", before["latency_ms"][p], after["latency_ms"][p]) for p in ("p50", "p95", "p99")]
+        rows.append(("errors", before["errors"], after["errors"]))
+        for metric, old, new in rows:
+            print(f"{name:15} {metric:12} {str(old):>12} {str(new):>12} {change(old, new):>9}")
+
+
+if __name__ == "__main__":
+    main()
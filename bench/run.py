@@ -0,0 +1,213 @@
+"""Drive the app with the benchmark scenarios and write throughput and latency percentiles to JSON.
+
+Runs the app in-process through httpx's ASGI transport by default, or against
+a running server with --base-url. Seed the database first with bench.seed.
+
+    python -m bench.run --output bench_output.json
+    python -m bench.run --base-url http://localhost:8000 --scenarios badge_lookup,status_toggle
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.seed import BENCH_COLUMNS, BENCH_STAFF_EMAIL, BENCH_STAFF_PASSWORD, event_names  # noqa: E402
+
+
+class Fixture:
+    def __init__(self, events, codes):
+        self.events = events
+        self.codes = codes
+        self.rng = random.Random(7)
+
+    def code(self):
+        return self.rng.choice(self.codes)
+
+    def event(self):
+        return self.rng.choice(self.events)
+
+
+async def badge_lookup(client, fixture):
+    return await client.get(f"/record/{fixture.code()}/")
+
+
+async def status_toggle(client, fixture):
+    status = "true" if fixture.rng.random() < 0.5 else "false"
+    return await client.put(f"/record/{fixture.code()}/update_status/", params={"column": "signed_in", "status": status})
+
+
+async def event_page(client, fixture):
+    return await client.post(f"/records/{fixture.event()}/", params={"parameters": BENCH_COLUMNS})
+
+
+async def records_list(client, fixture):
+    return await client.get(f"/records/{fixture.event()}/", params={"limit": 100})
+
+
+async def csv_export(client, fixture):
+    return await client.get("/download_csv/", params={"columns": "code,signed_in", "keys": "name,email", "event_name": fixture.event()})
+
+
+async def login(client, fixture):
+    return await client.post("/login", data={"email": BENCH_STAFF_EMAIL, "password": BENCH_STAFF_PASSWORD})
+
+
+SCENARIOS = {
+    "badge_lookup": badge_lookup,
+    "status_toggle": status_toggle,
+    "event_page": event_page,
+    "records_list": records_list,
+    "csv_export": csv_export,
+    "login": login,
+}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client, fixture, scenario, requests, concurrency, warmup):
+    for _ in range(warmup):
+        await scenario(client, fixture)
+
+    latencies = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(counter) < requests:
+            start = time.perf_counter()
+            try:
+                response = await scenario(client, fixture)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    to_ms = lambda value: None if value is None else round(value * 1000, 3)  # noqa: E731
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": to_ms(percentile(latencies, 0.50)),
+            "p95": to_ms(percentile(latencies, 0.95)),
+            "p99": to_ms(percentile(latencies, 0.99)),
+            "max": to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+@asynccontextmanager
+async def open_client(base_url):
+    if base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            yield client
+        return
+
+    from main import app
+
+    # Run the app's startup and shutdown around the in-process client
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+
+async def load_fixture(prefix, events):
+    from main import create_db_pool
+
+    names = event_names(prefix, events)
+    db_pool = await create_db_pool()
+    try:
+        async with db_pool.pool.acquire() as connection:
+            rows = await connection.fetch(
+                "SELECT code FROM records WHERE event_name = ANY($1::text[]) AND code IS NOT NULL ORDER BY md5(code) LIMIT 5000", names)
+    finally:
+        await db_pool.close()
+    if not rows:
+        raise SystemExit("No benchmark records found; run `python -m bench.seed` first")
+    return Fixture(names, [row["code"] for row in rows])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    fixture = await load_fixture(args.prefix, args.events)
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    results = {}
+    async with open_client(args.base_url) as client:
+        for name in names:
+            requests = args.login_requests if name == "login" else args.requests
+            results[name] = await run_scenario(client, fixture, SCENARIOS[name], requests, args.concurrency, args.warmup)
+            summary = results[name]
+            print(f"{name:15} {summary['throughput_rps']:>9} req/s  p50 {summary['latency_ms']['p50']} ms  "
+                  f"p95 {summary['latency_ms']['p95']} ms  p99 {summary['latency_ms']['p99']} ms  errors {summary['errors']}")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "mode": "http" if args.base_url else "asgi",
+        "python": platform.python_version(),
+        "settings": {"events": args.events, "requests": args.requests, "login_requests": args.login_requests,
+                     "concurrency": args.concurrency, "warmup": args.warmup},
+        "scenarios": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {args.output}")
+
+
+def main():
+    # The app configures INFO logging; a line per benchmark request would drown the results
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--scenarios", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=100, help="requests for the bcrypt-bound login scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--events", type=int, default=3, help="number of seeded events to use")
+    parser.add_argument("--prefix", default="bench-event")
+    parser.add_argument("--output", default="bench_output.json")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
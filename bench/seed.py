@@ -0,0 +1,75 @@
+"""Seed a local Postgres with synthetic events, records and a staff account for benchmarks.
+
+Uses the same DB_* settings as the app. Only rows of events named ``<prefix>-N``
+and the benchmark staff account are touched.
+
+    python -m bench.seed --events 3 --records 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import apply_migrations, create_db_pool, pwd_context  # noqa: E402
+
+BENCH_STAFF_EMAIL = "bench@example.com"
+BENCH_STAFF_PASSWORD = "bench-password"
+BENCH_COLUMNS = "name,email,ticket"
+TICKETS = ["General", "VIP", "Student", "Speaker", "Staff"]
+
+
+def event_names(prefix: str, events: int):
+    return [f"{prefix}-{number}" for number in range(1, events + 1)]
+
+
+def make_parameters(index: int, rng: random.Random):
+    return {
+        "name": f"Attendee {index}",
+        "email": f"attendee{index}@example.com",
+        "ticket": rng.choice(TICKETS),
+        "phone": f"+1555{index:07d}",
+    }
+
+
+async def seed(events: int, records: int, prefix: str, seed_value: int):
+    rng = random.Random(seed_value)
+    db_pool = await create_db_pool()
+    try:
+        await apply_migrations(db_pool)
+        names = event_names(prefix, events)
+        async with db_pool.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute("DELETE FROM records WHERE event_name = ANY($1::text[])", names)
+                await connection.execute("DELETE FROM record_deletions WHERE event_name = ANY($1::text[])", names)
+                for event_name in names:
+                    rows = [(event_name, json.dumps(make_parameters(index, rng)), rng.random() < 0.3, False)
+                            for index in range(records)]
+                    await connection.copy_records_to_table(
+                        "records", records=rows, columns=["event_name", "parameters", "signed_in", "signed_out"])
+
+                await connection.execute("DELETE FROM event_staff WHERE email = $1", BENCH_STAFF_EMAIL)
+                await connection.execute(
+                    "INSERT INTO event_staff (email, hashed_password, event_name, specified_columns) VALUES ($1, $2, $3, $4)",
+                    BENCH_STAFF_EMAIL, pwd_context.hash(BENCH_STAFF_PASSWORD), names[0], BENCH_COLUMNS)
+            await connection.execute("ANALYZE records")
+    finally:
+        await db_pool.close()
+    print(f"Seeded {events} event(s) x {records} record(s) with prefix '{prefix}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=3)
+    parser.add_argument("--records", type=int, default=10000, help="records per event")
+    parser.add_argument("--prefix", default="bench-event")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(seed(args.events, args.records, args.prefix, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import aiosmtplib
+
+from metrics import EMAIL_SEND_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueueFull(Exception):
+    pass
+
+
+class MailJob:
+    """A queued email.
+
+    ``message`` is either a ready message or a zero-argument callable that
+    builds one; callables are run on a worker thread just before the first
+    delivery attempt, so large attachments are only read when they are sent.
+    ``cleanup`` is called and the message released once the job is sent, has
+    failed for good, or is dropped.
+    """
+
+    def __init__(self, message, cleanup: Optional[Callable[[], None]] = None):
+        self.id = uuid.uuid4().hex
+        self.message = message
+        self.cleanup = cleanup
+        self.status = "queued"
+        self.attempts = 0
+        self.error: Optional[str] = None
+
+    def finish(self, status: str):
+        self.status = status
+        # Finished jobs stay in the history for status lookups; only keep what as_dict() reports
+        self.message = None
+        cleanup, self.cleanup = self.cleanup, None
+        if cleanup is not None:
+            try:
+                cleanup()
+            except Exception:
+                logger.exception("Cleanup failed for mail job %s", self.id)
+
+    def as_dict(self):
+        return {"job_id": self.id, "status": self.status, "attempts": self.attempts, "error": self.error}
+
+
+class MailDispatcher:
+    """Background email sender.
+
+    Messages are queued in-process and delivered by a fixed number of sender
+    tasks. Each sender keeps its own SMTP session open between messages,
+    reconnecting when the server drops it, and drains up to ``batch_size``
+    queued messages per wake-up. Failed sends are retried with exponential
+    backoff.
+    """
+
+    def __init__(self, hostname: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 start_tls: bool = True, use_tls: bool = False, timeout: float = 30, senders: int = 2,
+                 batch_size: int = 20, queue_size: int = 1000, max_attempts: int = 5,
+                 retry_base_delay: float = 1.0, job_history: int = 1000):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.senders = senders
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.job_history = job_history
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.jobs: "OrderedDict[str, MailJob]" = OrderedDict()
+        self._tasks = []
+        self._retry_tasks = set()
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._run_sender()) for _ in range(self.senders)]
+
+    async def stop(self, timeout: float = 10):
+        # Give queued messages a chance to go out before cancelling the senders
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Mail queue not drained on shutdown, %s message(s) dropped", self.queue.qsize())
+        for task in [*self._tasks, *self._retry_tasks]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retry_tasks, return_exceptions=True)
+        self._tasks = []
+        for job in self.jobs.values():
+            if job.status not in ("sent", "failed"):
+                job.finish("dropped")
+
+    def submit(self, message, cleanup: Optional[Callable[[], None]] = None) -> str:
+        job = MailJob(message, cleanup)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            job.finish("dropped")
+            raise MailQueueFull("Mail queue is full")
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.job_history:
+            self.jobs.popitem(last=False)
+        return job.id
+
+    def get_job(self, job_id: str) -> Optional[MailJob]:
+        return self.jobs.get(job_id)
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "senders": len(self._tasks), "retrying": len(self._retry_tasks)}
+
+    async def _connect(self):
+        smtp = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, use_tls=self.use_tls,
+                               start_tls=self.start_tls, timeout=self.timeout)
+        await smtp.connect()
+        if self.username:
+            await smtp.login(self.username, self.password)
+        return smtp
+
+    async def _run_sender(self):
+        smtp = None
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+                for job in batch:
+                    try:
+                        smtp = await self._deliver(smtp, job)
+                    except Exception as e:
+                        # A message that can never be sent (e.g. no From header) must not take the sender down
+                        job.error = str(e)
+                        job.finish("failed")
+                        logger.exception("Mail job %s failed", job.id)
+                    finally:
+                        self.queue.task_done()
+        finally:
+            if smtp is not None and smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except aiosmtplib.SMTPException:
+                    smtp.close()
+
+    async def _deliver(self, smtp, job: MailJob):
+        job.status = "sending"
+        job.attempts += 1
+        if callable(job.message):
+            try:
+                job.message = await asyncio.to_thread(job.message)
+            except Exception as e:
+                job.error = str(e)
+                job.finish("failed")
+                logger.exception("Could not build mail job %s", job.id)
+                return smtp
+
+        start = time.perf_counter()
+        try:
+            if smtp is None or not smtp.is_connected:
+                smtp = await self._connect()
+            try:
+                await smtp.send_message(job.message)
+            except aiosmtplib.SMTPServerDisconnected:
+                # The server dropped an idle session; reconnect once and resend
+                smtp = await self._connect()
+                await smtp.send_message(job.message)
+        except (aiosmtplib.SMTPException, OSError) as e:
+            EMAIL_SEND_LATENCY.labels("error").observe(time.perf_counter() - start)
+            job.error = str(e)
+            if smtp is not None and not isinstance(e, aiosmtplib.SMTPResponseException):
+                smtp.close()
+                smtp = None
+            if job.attempts < self.max_attempts:
+                job.status = "retrying"
+                self._schedule_retry(job)
+            else:
+                job.finish("failed")
+                logger.error("Giving up on mail job %s after %s attempts: %s", job.id, job.attempts, e)
+            return smtp
+        EMAIL_SEND_LATENCY.labels("sent").observe(time.perf_counter() - start)
+        job.error = None
+        job.finish("sent")
+        return smtp
+
+    def _schedule_retry(self, job: MailJob):
+        delay = self.retry_base_delay * (2 ** (job.attempts - 1))
+
+        async def retry():
+            await asyncio.sleep(delay)
+            await self.queue.put(job)
+
+        task = asyncio.create_task(retry())
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
@@ -1,34 +1,111 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, Form, responses, Query, Response, UploadFile, File
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, HTTPException, Depends, Request, Form, responses, Query, Response, Body
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import RedirectResponse, ORJSONResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
-from starlette.responses import HTMLResponse, FileResponse
+from starlette.responses import HTMLResponse
 from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 import os
 import asyncpg
 import json
+import hashlib
 from dotenv import load_dotenv
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
+from contextlib import asynccontextmanager
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+import logging
 import jwt
-from datetime import datetime, timedelta
+import orjson
+from datetime import datetime, timedelta, timezone
 from fastapi.staticfiles import StaticFiles
 import csv
-import smtplib
+import re
+import zlib
+import io
+import tempfile
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
+from mailer import MailDispatcher, MailQueueFull
+from cache import LRUCache
+from metrics import time_query, observe_request, QUERY_LATENCY, render_metrics, TEMPLATE_RENDER_LATENCY, REQUESTS_IN_FLIGHT, DB_POOL_SIZE, DB_POOL_IDLE, DB_POOL_WAITERS, DB_POOL_ACQUIRE_LATENCY
+from starlette.routing import Match
+from starlette.formparsers import MultiPartParser
+from starlette.datastructures import UploadFile
 
 load_dotenv()
 
-app = FastAPI()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("forms")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One connection pool per worker process, shared by every request
+    app.state.db_pool = await create_db_pool()
+    if RUN_MIGRATIONS:
+        await apply_migrations(app.state.db_pool)
+    await record_change_hub.start()
+    await mail_dispatcher.start()
+    prune_task = asyncio.create_task(prune_record_deletions(app.state.db_pool))
+    try:
+        yield
+    finally:
+        prune_task.cancel()
+        await asyncio.gather(prune_task, return_exceptions=True)
+        await mail_dispatcher.stop(timeout=MAIL_SHUTDOWN_TIMEOUT)
+        await record_change_hub.stop()
+        await app.state.db_pool.close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 templates = Jinja2Templates(directory="templates")
 
 # Mount the static files directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Route template for a request, so metrics are labelled /record/{code}/ rather than per code
+def route_label(request: Request) -> str:
+    route = request.scope.get("route")
+    if route is not None:
+        return route.path
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+# Record latency, status codes and in-flight requests for every route.
+# For streaming responses the latency covers the time until the response starts.
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        duration = time.perf_counter() - start
+        route = route_label(request)
+        observe_request(request.method, route, status_code, duration)
+        if duration * 1000 >= SLOW_REQUEST_THRESHOLD_MS:
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "method": request.method,
+                "route": route,
+                "path": request.url.path,
+                "status": status_code,
+                "duration_ms": round(duration * 1000, 1),
+            }))
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -40,8 +117,17 @@ app.add_middleware(
 # Secret key for signing JWT tokens
 SECRET_KEY = os.getenv("SECRET_KEY")
 
-# Token expiration time
-ACCESS_TOKEN_EXPIRE_MINUTES = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
+# Token expiration time; access tokens are short-lived and renewed with the refresh token
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+# Decoded access token claims kept in memory so repeat requests skip signature checks
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# Browser sessions carry the tokens in httpOnly cookies
+ACCESS_TOKEN_COOKIE = "access_token"
+REFRESH_TOKEN_COOKIE = "refresh_token"
+COOKIE_SECURE = os.getenv("COOKIE_SECURE", "false").lower() == "true"
 
 BASE_URL = os.getenv("BASE_URL")
 
@@ -49,11 +135,100 @@ SENDER_EMAIL = os.getenv("SENDER_EMAIL")
 SENDER_PASSWORD = os.getenv("SENDER_PASSWORD")
 RECIPIENT_EMAIL = os.getenv("RECIPIENT_EMAIL")
 
+# Outbound mail settings
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", SENDER_EMAIL)
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", SENDER_PASSWORD)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "false").lower() == "true"
+MAIL_SENDERS = int(os.getenv("MAIL_SENDERS", "2"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_SHUTDOWN_TIMEOUT = float(os.getenv("MAIL_SHUTDOWN_TIMEOUT", "10"))
+
 EVENT_NAME = os.getenv("EVENT_NAME")
 SPECIFIED_COLUMNS = os.getenv("SPECIFIED_COLUMNS")
 
+# Requests slower than this are logged
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "500"))
+
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+
+# Live record change notifications
+RECORD_CHANGES_CHANNEL = "records_changes"
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "100"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+# Event summary cache
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "5"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "256"))
+
+# Badge lookup cache
+RECORD_CACHE_SIZE = int(os.getenv("RECORD_CACHE_SIZE", "10000"))
+RECORD_CACHE_TTL = float(os.getenv("RECORD_CACHE_TTL", "30"))
+# "postgres" also drops entries changed by other workers; "local" only sees this worker's writes
+RECORD_CACHE_INVALIDATION = os.getenv("RECORD_CACHE_INVALIDATION", "postgres")
+
+# Schema migrations applied at startup
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "true").lower() == "true"
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATIONS_LOCK_ID = 4251337
+
+mail_dispatcher = MailDispatcher(
+    hostname=SMTP_HOST,
+    port=SMTP_PORT,
+    username=SMTP_USERNAME,
+    password=SMTP_PASSWORD,
+    start_tls=SMTP_STARTTLS,
+    use_tls=SMTP_USE_TLS,
+    senders=MAIL_SENDERS,
+    batch_size=MAIL_BATCH_SIZE,
+    queue_size=MAIL_QUEUE_SIZE,
+    max_attempts=MAIL_MAX_ATTEMPTS,
+)
+
+# Record listing settings
+RECORDS_PAGE_SIZE = int(os.getenv("RECORDS_PAGE_SIZE", "100"))
+RECORDS_MAX_PAGE_SIZE = int(os.getenv("RECORDS_MAX_PAGE_SIZE", "1000"))
+RECORDS_STREAM_PREFETCH = int(os.getenv("RECORDS_STREAM_PREFETCH", "500"))
+
+STATUS_BATCH_MAX_SIZE = int(os.getenv("STATUS_BATCH_MAX_SIZE", "1000"))
+
+# Bulk import settings
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+IMPORT_SPOOL_MEMORY_BYTES = int(os.getenv("IMPORT_SPOOL_MEMORY_BYTES", str(8 * 1024 * 1024)))
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+
+# Emailed CSV upload settings; attachments at or above UPLOAD_COMPRESS_MIN_BYTES are gzipped
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_COMPRESS_MIN_BYTES = int(os.getenv("UPLOAD_COMPRESS_MIN_BYTES", str(1024 * 1024)))
+
+# Changes that commit slightly after the cursor was taken are picked up by re-reading this window
+CHANGES_CURSOR_OVERLAP_SECONDS = float(os.getenv("CHANGES_CURSOR_OVERLAP_SECONDS", "5"))
+
+# Deletion tombstones older than this are pruned; clients with an older sync cursor must reload
+RECORD_DELETIONS_RETENTION_HOURS = float(os.getenv("RECORD_DELETIONS_RETENTION_HOURS", "24"))
+RECORD_DELETIONS_PRUNE_INTERVAL_SECONDS = float(os.getenv("RECORD_DELETIONS_PRUNE_INTERVAL_SECONDS", "3600"))
+
+# Password hashing settings
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Dedicated executor so bcrypt never runs on the event loop; it lives as long as the process,
+# so it is not shut down with the app and can serve a later lifespan in the same process
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+password_jobs_pending = 0
 
 # Sample event staff model
 class EventStaff(BaseModel):
@@ -64,80 +239,434 @@ class Record(BaseModel):
     event_name: str
     parameters: dict
 
+class StatusUpdate(BaseModel):
+    code: str
+    column: str
+    value: bool
+
 class EmailRequest(BaseModel):
     email: EmailStr
     otp: str
 
-def send_otp_email(recipient_email: str, otp: str):
-    sender_email = SENDER_EMAIL
-    sender_password = SENDER_PASSWORD
+# Queue a message (or a function building one) for background delivery and return its job ID
+def queue_email(message, cleanup=None) -> str:
+    try:
+        return mail_dispatcher.submit(message, cleanup)
+    except MailQueueFull:
+        raise HTTPException(status_code=503, detail="Mail queue is full, try again shortly", headers={"Retry-After": "5"})
 
+def send_otp_email(recipient_email: str, otp: str) -> str:
     message = MIMEMultipart()
-    message["From"] = sender_email
+    message["From"] = SENDER_EMAIL
     message["To"] = recipient_email
     message["Subject"] = "Your OTP Code"
 
     body = f"Your OTP code is: {otp}"
     message.attach(MIMEText(body, "plain"))
 
-    try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, recipient_email, message.as_string())
-        server.close()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {e}")
+    return queue_email(message)
+
+@app.post("/send-otp", status_code=202)
+async def send_otp(request: EmailRequest):
+    job_id = send_otp_email(request.email, request.otp)
+    return {"message": "OTP queued for delivery", "job_id": job_id}
 
-@app.post("/send-otp")
-def send_otp(request: EmailRequest):
-    send_otp_email(request.email, request.otp)
-    return {"message": "OTP sent successfully"}    
+# Endpoint to check the delivery status of a queued email
+@app.get("/mail-jobs/{job_id}")
+async def read_mail_job(job_id: str):
+    job = mail_dispatcher.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Mail job not found")
+    return job.as_dict()
 
 # Database Connection Pool
+class DatabasePool:
+    """Wraps the asyncpg pool to bound acquire time and keep live usage stats."""
+
+    def __init__(self, pool, acquire_timeout: float, latency_samples: int = 1024):
+        self.pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.waiters = 0
+        self.acquire_count = 0
+        self.acquire_timeouts = 0
+        self.acquire_latencies = deque(maxlen=latency_samples)
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.waiters += 1
+        DB_POOL_WAITERS.inc()
+        start = time.perf_counter()
+        try:
+            connection = await self.pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.acquire_timeouts += 1
+            raise HTTPException(status_code=503, detail="Database is busy, try again shortly")
+        finally:
+            self.waiters -= 1
+            DB_POOL_WAITERS.dec()
+        latency = time.perf_counter() - start
+        self.acquire_count += 1
+        self.acquire_latencies.append(latency)
+        DB_POOL_ACQUIRE_LATENCY.observe(latency)
+        try:
+            yield connection
+        finally:
+            await self.pool.release(connection)
+            DB_POOL_SIZE.set(self.pool.get_size())
+            DB_POOL_IDLE.set(self.pool.get_idle_size())
+
+    async def close(self):
+        await self.pool.close()
+
+    def stats(self):
+        latencies = sorted(self.acquire_latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "waiters": self.waiters,
+            "acquired_total": self.acquire_count,
+            "acquire_timeouts": self.acquire_timeouts,
+            "acquire_latency_ms": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1] * 1000, 3) if latencies else None,
+            },
+        }
+
+# Connection settings shared by the pool and the LISTEN connection
+def db_connection_settings():
+    return {
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "database": os.getenv("DB_NAME"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+    }
+
 async def create_db_pool():
-    db_pool = await asyncpg.create_pool(
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        min_size=1,
-        max_size=5
+    pool = await asyncpg.create_pool(
+        **db_connection_settings(),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        init=prepare_hot_statements,
     )
-    return db_pool
+    return DatabasePool(pool, acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT)
+
+# Pool init hook: run the check-in hot path once on every new connection so its statements are
+# already parsed, planned and in the statement cache when the first real request arrives.
+# The arguments match no rows, so nothing is read or changed.
+async def prepare_hot_statements(connection):
+    if DB_STATEMENT_CACHE_SIZE <= 0:
+        return
+    try:
+        with time_query("prepare_hot_statements"):
+            await connection.fetchval(READ_RECORD_QUERY, "")
+            for column in ["signed_in", "signed_out"]:
+                await connection.fetchval(UPDATE_STATUS_QUERY.format(column), False, "")
+            conditions, args = build_record_filters("")
+            for after in [None, 0]:
+                query, query_args = build_records_query(conditions, args, after, RECORDS_PAGE_SIZE + 1)
+                await connection.fetch(query, *query_args)
+    except asyncpg.PostgresError as e:
+        # On a fresh database the pool opens before migrations have run
+        logger.info("Skipping statement warmup: %s", e)
+
+class RecordChangeHub:
+    """Fans record change notifications out to subscribed clients.
+
+    Each worker keeps a single LISTEN connection and forwards every
+    notification to the queues subscribed to that event, and to in-process
+    handlers such as cache invalidation. A client that falls behind has its
+    backlog dropped and is told to resync instead.
+    """
+
+    def __init__(self, channel: str, queue_size: int):
+        self.channel = channel
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+        self.handlers = []
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def subscribe(self, event_name: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[event_name].add(queue)
+        return queue
+
+    def unsubscribe(self, event_name: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(event_name)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[event_name]
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def publish(self, change: dict):
+        for handler in self.handlers:
+            handler(change)
+        for queue in list(self.subscribers.get(change.get("event_name"), ())):
+            self._offer(queue, change)
+
+    def publish_resync(self):
+        resync = {"op": "RESYNC"}
+        for handler in self.handlers:
+            handler(resync)
+        for queues in list(self.subscribers.values()):
+            for queue in list(queues):
+                self._offer(queue, resync)
+
+    def _offer(self, queue: asyncio.Queue, message: dict):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Slow client: its backlog is stale anyway, so replace it with a resync request
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"op": "RESYNC"})
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            return
+        self.publish(change)
+
+    async def _run(self):
+        delay = 1
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(**db_connection_settings())
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(self.channel, self._on_notification)
+                delay = 1
+                # Anything sent while we were disconnected was missed
+                self.publish_resync()
+                await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Record change listener failed, reconnecting")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+record_change_hub = RecordChangeHub(RECORD_CHANGES_CHANNEL, SUBSCRIBER_QUEUE_SIZE)
+
+# Per-event summary counts, keyed by event name then breakdown key
+summary_cache = LRUCache(maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+# Bumped on every invalidation so a query that raced with a write is not cached
+summary_version = 0
+
+def invalidate_event_summary(event_name: Optional[str]):
+    global summary_version
+    summary_version += 1
+    summary_cache.pop(event_name)
+
+# Drop cached summaries when any worker changes an event's records
+def invalidate_summaries_on_change(change: dict):
+    global summary_version
+    if change.get("op") == "RESYNC":
+        summary_version += 1
+        summary_cache.clear()
+    else:
+        invalidate_event_summary(change.get("event_name"))
+
+record_change_hub.add_handler(invalidate_summaries_on_change)
+
+class LocalRecordInvalidation:
+    """Drops cached records changed through this worker only."""
+
+    def __init__(self, cache: LRUCache):
+        self.cache = cache
+        # Bumped on every invalidation so a lookup that raced with a write is not cached
+        self.version = 0
+
+    def invalidate(self, code: Optional[str]):
+        self.version += 1
+        self.cache.pop(code)
+
+    def clear(self):
+        self.version += 1
+        self.cache.clear()
+
+class PostgresRecordInvalidation(LocalRecordInvalidation):
+    """Also drops records changed by other workers, as reported on the records_changes channel."""
+
+    def __init__(self, cache: LRUCache, hub: RecordChangeHub):
+        super().__init__(cache)
+        hub.add_handler(self.on_change)
+
+    def on_change(self, change: dict):
+        if change.get("op") == "RESYNC":
+            self.clear()
+        elif change.get("code") is not None:
+            self.invalidate(change["code"])
+
+# Serialized GET /record/{code}/ responses, keyed by code
+record_cache = LRUCache(maxsize=RECORD_CACHE_SIZE, ttl=RECORD_CACHE_TTL)
+if RECORD_CACHE_INVALIDATION == "local":
+    record_invalidation = LocalRecordInvalidation(record_cache)
+else:
+    record_invalidation = PostgresRecordInvalidation(record_cache, record_change_hub)
+
+# Apply any SQL files in migrations/ that have not run yet, in filename order
+async def apply_migrations(db_pool):
+    async with db_pool.acquire() as connection:
+        # Workers start together, so only one of them may migrate at a time
+        await connection.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+        try:
+            await connection.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())")
+            applied = {row['name'] for row in await connection.fetch("SELECT name FROM schema_migrations")}
+            for name in sorted(os.listdir(MIGRATIONS_DIR)):
+                if not name.endswith(".sql") or name in applied:
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, name)) as file:
+                    sql = file.read()
+                with time_query("apply_migration"):
+                    async with connection.transaction():
+                        await connection.execute(sql)
+                        await connection.execute("INSERT INTO schema_migrations (name) VALUES ($1)", name)
+        finally:
+            await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+
+# Periodically drop deletion tombstones that no valid sync cursor can still need
+async def prune_record_deletions(db_pool):
+    while True:
+        try:
+            async with db_pool.acquire() as connection:
+                with time_query("prune_record_deletions"):
+                    await connection.execute(
+                        "DELETE FROM record_deletions WHERE deleted_at < now() - make_interval(secs => $1)",
+                        RECORD_DELETIONS_RETENTION_HOURS * 3600)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Failed to prune record deletions")
+        await asyncio.sleep(RECORD_DELETIONS_PRUNE_INTERVAL_SECONDS)
+
+# Render a template, recording how long Jinja took
+def render_template(name: str, context: dict):
+    with TEMPLATE_RENDER_LATENCY.labels(name).time():
+        return templates.TemplateResponse(request=context["request"], name=name, context=context)
+
+# Dependency returning the pool created at startup
+def get_db_pool(request: Request):
+    return request.app.state.db_pool
+
+# Run a password hashing call on the password executor, rejecting work when it is saturated
+async def run_password_job(func, *args):
+    global password_jobs_pending
+    if password_jobs_pending >= PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(status_code=503, detail="Server is busy, try again shortly", headers={"Retry-After": "1"})
+    password_jobs_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs_pending -= 1
 
 # Generate password hash
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await run_password_job(pwd_context.hash, password)
 
-# Verify password
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Verify password, returning a new hash when the stored one uses outdated settings
+async def verify_password(plain_password, hashed_password):
+    return await run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
 
 # Token creation
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, token_type: str = "access"):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": token_type})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
-# Authentication middleware
-async def get_current_user(token: str = Depends(create_access_token)):
+# Fingerprint of the stored password hash; refresh tokens carry it so a password change ends existing sessions
+def password_fingerprint(hashed_password: str) -> str:
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+# Issue a new access / refresh token pair for a staff member
+def issue_tokens(email: str, hashed_password: str):
+    access_token = create_access_token(data={"sub": email}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    refresh_token = create_access_token(
+        data={"sub": email, "pwd": password_fingerprint(hashed_password)},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS), token_type="refresh")
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+def set_auth_cookies(response: Response, tokens: dict):
+    response.set_cookie(ACCESS_TOKEN_COOKIE, tokens["access_token"], max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+                        httponly=True, secure=COOKIE_SECURE, samesite="lax")
+    # The refresh token is only ever sent to the refresh endpoint
+    response.set_cookie(REFRESH_TOKEN_COOKIE, tokens["refresh_token"], max_age=REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+                        httponly=True, secure=COOKIE_SECURE, samesite="strict", path="/token/refresh")
+
+def clear_auth_cookies(response: Response):
+    response.delete_cookie(ACCESS_TOKEN_COOKIE)
+    response.delete_cookie(REFRESH_TOKEN_COOKIE, path="/token/refresh")
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# Access token claims by sha256 of the token, each kept until the token expires
+token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+def decode_token(token: str, token_type: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    return email
+        raise HTTPException(status_code=401, detail="Token has expired", headers={"WWW-Authenticate": "Bearer"})
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    if payload.get("type", "access") != token_type or payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials", headers={"WWW-Authenticate": "Bearer"})
+    return payload
+
+# Authentication dependency: bearer token from the Authorization header, or the session cookie
+async def get_current_user(request: Request, token: Optional[str] = Depends(oauth2_scheme)):
+    token = token or request.cookies.get(ACCESS_TOKEN_COOKIE)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = decode_token(token, "access")
+        token_cache.set(key, payload, ttl=payload["exp"] - time.time())
+    elif payload["exp"] <= time.time():
+        raise HTTPException(status_code=401, detail="Token has expired", headers={"WWW-Authenticate": "Bearer"})
+    return payload["sub"]
 
 @app.get("/", include_in_schema=False)
 async def index() -> responses.RedirectResponse:
@@ -145,12 +674,12 @@ async def index() -> responses.RedirectResponse:
 
 # Create event staff endpoint
 @app.post("/event-staff/", response_model=EventStaff)
-async def create_event_staff(staff: EventStaff, event_name: str = EVENT_NAME, specified_columns: str = SPECIFIED_COLUMNS, db_pool=Depends(create_db_pool)):
+async def create_event_staff(staff: EventStaff, event_name: str = EVENT_NAME, specified_columns: str = SPECIFIED_COLUMNS, db_pool=Depends(get_db_pool)):
+    # Hash the password before taking a connection from the pool
+    hashed_password = await get_password_hash(staff.password)
+
     async with db_pool.acquire() as connection:
         try:
-            # Hash the password
-            hashed_password = get_password_hash(staff.password)
-            
             # Construct the SQL query with parameterized values
             query = f"""
                 INSERT INTO event_staff (email, hashed_password, event_name, specified_columns)
@@ -158,13 +687,14 @@ async def create_event_staff(staff: EventStaff, event_name: str = EVENT_NAME, sp
             """
             
             # Execute the SQL query with actual values
-            await connection.execute(
-                query,
-                staff.email,
-                hashed_password,
-                event_name,
-                specified_columns
-            )
+            with time_query("create_event_staff"):
+                await connection.execute(
+                    query,
+                    staff.email,
+                    hashed_password,
+                    event_name,
+                    specified_columns
+                )
             
             return staff
         except asyncpg.exceptions.UniqueViolationError:
@@ -175,127 +705,218 @@ async def create_event_staff(staff: EventStaff, event_name: str = EVENT_NAME, sp
 # Endpoint to render the login page
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return render_template("login.html", {"request": request})
+
+# Check staff credentials and return the staff row
+async def authenticate_staff(email: str, password: str, db_pool):
+    async with db_pool.acquire() as connection:
+        # Query the database to check if the event_staff exists
+        with time_query("login_lookup"):
+            event_staff = await connection.fetchrow(
+                "SELECT id, email, hashed_password, event_name, specified_columns FROM event_staff WHERE email = $1", email)
+    if event_staff is None:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    # Check if the password matches (without holding a connection during bcrypt)
+    password_valid, new_hash = await verify_password(password, event_staff['hashed_password'])
+    if not password_valid:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    # Transparently upgrade hashes created with outdated settings
+    if new_hash is not None:
+        async with db_pool.acquire() as connection:
+            with time_query("rehash_password"):
+                await connection.execute(
+                    "UPDATE event_staff SET hashed_password = $1 WHERE id = $2", new_hash, event_staff['id'])
+        event_staff = {**dict(event_staff), "hashed_password": new_hash}
+    return event_staff
 
 # Endpoint to handle login form submission
 @app.post("/login")
-async def login(request: Request, email: str = Form(...), password: str = Form(...), db_pool = Depends(create_db_pool)):
+async def login(request: Request, email: str = Form(...), password: str = Form(...), db_pool = Depends(get_db_pool)):
+    event_staff = await authenticate_staff(email, password, db_pool)
+
+    # Redirect the user to the desired URL after successful login, with the session in cookies
+    redirect_url = f"{BASE_URL}/records/{event_staff['event_name']}/?parameters={event_staff['specified_columns']}"
+    response = RedirectResponse(url=redirect_url)
+    set_auth_cookies(response, issue_tokens(email, event_staff['hashed_password']))
+    return response
+
+# OAuth2 password flow endpoint for API clients
+@app.post("/token")
+async def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), db_pool = Depends(get_db_pool)):
+    event_staff = await authenticate_staff(form_data.username, form_data.password, db_pool)
+    tokens = issue_tokens(event_staff['email'], event_staff['hashed_password'])
+    set_auth_cookies(response, tokens)
+    return tokens
+
+# Endpoint to exchange a refresh token for a new token pair without re-entering the password
+@app.post("/token/refresh")
+async def refresh_access_token(request: Request, response: Response, refresh_token: Optional[str] = Body(None, embed=True), db_pool = Depends(get_db_pool)):
+    refresh_token = refresh_token or request.cookies.get(REFRESH_TOKEN_COOKIE)
+    if not refresh_token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    payload = decode_token(refresh_token, "refresh")
+
+    # A cheap lookup instead of bcrypt: the account must still exist with the same password
     async with db_pool.acquire() as connection:
-        # Query the database to check if the event_staff exists and the password is correct
-        event_staff = await connection.fetchrow(
-            "SELECT id, email, hashed_password, event_name, specified_columns FROM event_staff WHERE email = $1", email)
-        if event_staff is None:
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-        
-        # Check if the password matches
-        if not verify_password(password, event_staff['hashed_password']):
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-
-        # If the credentials are valid, create a JWT token and return it to the client
-        access_token_expires = timedelta(minutes=int(ACCESS_TOKEN_EXPIRE_MINUTES))
-        access_token = create_access_token(data={"sub": email}, expires_delta=access_token_expires)
-        # return {"access_token": access_token, "token_type": "bearer"}
-        # Redirect the user to the desired URL after successful login
-        redirect_url = f"{BASE_URL}/records/{event_staff['event_name']}/?parameters={event_staff['specified_columns']}"
-        return RedirectResponse(url=redirect_url, headers={"Authorization": f"Bearer {access_token}"})
+        with time_query("refresh_lookup"):
+            hashed_password = await connection.fetchval(
+                "SELECT hashed_password FROM event_staff WHERE email = $1", payload["sub"])
+    if hashed_password is None or password_fingerprint(hashed_password) != payload.get("pwd"):
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+
+    tokens = issue_tokens(payload["sub"], hashed_password)
+    set_auth_cookies(response, tokens)
+    return tokens
 
 # Protected endpoint example
 @app.get("/protected/")
 async def protected_route(current_user: str = Depends(get_current_user)):
     return {"message": f"Welcome {current_user}"}
 
-# Logout endpoint (just for demonstration, as JWT tokens are stateless)
+# Logout endpoint; tokens are stateless, so this drops the session cookies
 @app.post("/event-staff/logout/")
 async def event_staff_logout():
-    return RedirectResponse(url="/login")
+    response = RedirectResponse(url="/login", status_code=303)
+    clear_auth_cookies(response)
+    return response
 
 # Update event staff password endpoint
 @app.put("/event-staff/me/password/")
-async def update_staff_password(new_password: str, current_user: str = Depends(get_current_user), db_pool = Depends(create_db_pool)):
+async def update_staff_password(new_password: str, current_user: str = Depends(get_current_user), db_pool = Depends(get_db_pool)):
+    hashed_password = await get_password_hash(new_password)
     async with db_pool.acquire() as connection:
         try:
-            hashed_password = get_password_hash(new_password)
-            await connection.execute(
-                "UPDATE event_staff SET hashed_password = $1 WHERE email = $2",
-                hashed_password, current_user
-            )
+            with time_query("update_staff_password"):
+                await connection.execute(
+                    "UPDATE event_staff SET hashed_password = $1 WHERE email = $2",
+                    hashed_password, current_user
+                )
             return {"message": "Password updated successfully"}
         except Exception as e:
             raise HTTPException(status_code=500, detail="Failed to update password")
 
 # Delete event staff account endpoint
 @app.delete("/event-staff/me/")
-async def delete_event_staff_account(current_user: str = Depends(get_current_user), db_pool = Depends(create_db_pool)):
+async def delete_event_staff_account(current_user: str = Depends(get_current_user), db_pool = Depends(get_db_pool)):
     async with db_pool.acquire() as connection:
         try:
-            await connection.execute(
-                "DELETE FROM event_staff WHERE email = $1",
-                current_user
-            )
+            with time_query("delete_event_staff"):
+                await connection.execute(
+                    "DELETE FROM event_staff WHERE email = $1",
+                    current_user
+                )
             return {"message": "Event staff account deleted successfully"}
         except Exception as e:
             raise HTTPException(status_code=500, detail="Failed to delete event staff account")
         
 # Endpoint to update the simple_code column
 @app.put("/update_codes/")
-async def update_codes(db_pool=Depends(create_db_pool)):
+async def update_codes(db_pool=Depends(get_db_pool)):
     async with db_pool.acquire() as connection:
         try:
-            # Update simple_code column based on event_name and id
-            await connection.execute('''
-                UPDATE records
-                SET code = event_name || '-' || LPAD(id::TEXT, 4, '0')
-            ''')
+            # New rows get a code on insert, so only fill in rows that are still missing one
+            with time_query("update_codes"):
+                result = await connection.execute('''
+                    UPDATE records
+                    SET code = event_name || '-' || LPAD(id::TEXT, GREATEST(4, length(id::TEXT)), '0')
+                    WHERE code IS NULL
+                ''')
 
-            return {"message": "Codes updated successfully"}
+            return {"message": "Codes updated successfully", "updated": int(result.split()[-1])}
 
         except asyncpg.PostgresError as e:
             raise HTTPException(status_code=500, detail=f"Error updating codes: {e}")
         
-# Endpoint to create CSV file for a specified column
-@app.get("/create_csv/")
-async def create_csv(column: str = Query(...), db_pool=Depends(create_db_pool)):
-    async with db_pool.acquire() as connection:
+# Columns of records that can be exported, besides form answers
+EXPORT_COLUMNS = ["id", "event_name", "code", "created_at", "updated_at", "signed_in", "signed_out"]
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+# Stream the output of COPY ... TO STDOUT, optionally gzip-compressed
+def stream_copy(db_pool, query: str, args: list, header: bool, compress: bool):
+    async def generate():
+        # A small queue applies backpressure: COPY pauses while the client is slow
+        chunks = asyncio.Queue(maxsize=16)
+        blocked = 0.0
+
+        async def write(data):
+            nonlocal blocked
+            start = time.perf_counter()
+            await chunks.put(bytes(data))
+            blocked += time.perf_counter() - start
+
+        async def run_copy():
+            async with db_pool.acquire() as connection:
+                start = time.perf_counter()
+                try:
+                    await connection.copy_from_query(query, *args, output=write, format="csv", header=header)
+                finally:
+                    # Leave out the time COPY sat waiting on a slow client
+                    QUERY_LATENCY.labels("export_copy").observe(time.perf_counter() - start - blocked)
+
+        copy_task = asyncio.create_task(run_copy())
+        compressor = zlib.compressobj(wbits=31) if compress else None
         try:
-            # Fetch data for the specified column from the records table
-            records = await connection.fetch("SELECT {} FROM records".format(column))
-            if not records:
-                raise HTTPException(status_code=404, detail="No records found")
-
-            # Define directory to save CSV file
-            directory = "files"
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-
-            # Define CSV file path
-            csv_file_path = os.path.join(directory, f"data.csv")
-
-            # Write data to CSV file
-            with open(csv_file_path, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                # writer.writerow([column])  # Write column header
-                for record in records:
-                    writer.writerow([record[column]])
-
-            return {"message": f"CSV file created successfully at: {csv_file_path}"}
-
-        except asyncpg.PostgresError as e:
-            raise HTTPException(status_code=500, detail=f"Error fetching data: {e}")
-        
-# Endpoint to download the CSV file
+            while True:
+                next_chunk = asyncio.ensure_future(chunks.get())
+                await asyncio.wait({next_chunk, copy_task}, return_when=asyncio.FIRST_COMPLETED)
+                if next_chunk.done():
+                    chunk = next_chunk.result()
+                else:
+                    next_chunk.cancel()
+                    if chunks.empty():
+                        break
+                    chunk = chunks.get_nowait()
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+            # Surface COPY errors instead of ending the download silently
+            copy_task.result()
+            if compressor is not None:
+                yield compressor.flush()
+        finally:
+            copy_task.cancel()
+            await asyncio.gather(copy_task, return_exceptions=True)
+
+    return generate()
+
+# Endpoint to download records as CSV, streamed straight from Postgres
 @app.get("/download_csv/")
-async def download_csv(response: Response):
-    file_path = "files/data.csv"
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="CSV file not found")
-
-    return FileResponse(file_path, media_type='text/csv', filename="data.csv")
-
-# Function to send email
-async def send_email(subject, body, to_email, attachment_data, attachment_filename):
-    smtp_server = 'smtp.gmail.com'
-    smtp_port = 587
+async def download_csv(columns: str = "code", keys: Optional[str] = None, event_name: Optional[str] = None, header: bool = True, gzip: bool = False, db_pool=Depends(get_db_pool)):
+    column_list = [column for column in columns.split(",") if column]
+    key_list = [key for key in (keys or "").split(",") if key]
+    invalid_columns = [column for column in column_list if column not in EXPORT_COLUMNS]
+    if invalid_columns:
+        raise HTTPException(status_code=400, detail=f"Invalid column name(s): {', '.join(invalid_columns)}")
+    if not column_list and not key_list:
+        raise HTTPException(status_code=400, detail="Specify at least one column or key")
+    if any("\x00" in key for key in key_list):
+        raise HTTPException(status_code=400, detail="Invalid key name")
+
+    args = []
+    selected = list(column_list)
+    for key in key_list:
+        args.append(key)
+        selected.append(f"parameters ->> ${len(args)} AS {quote_identifier(key)}")
+    query = f"SELECT {', '.join(selected)} FROM records"
+    if event_name is not None:
+        args.append(event_name)
+        query += f" WHERE event_name = ${len(args)}"
+    query += " ORDER BY id"
+
+    filename = re.sub(r"[^A-Za-z0-9_.-]", "_", event_name or "records") + ".csv" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream_copy(db_pool, query, args, header, gzip),
+        media_type="application/gzip" if gzip else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
+# Function to build an email with an attachment
+def build_email(subject, body, to_email, attachment_data, attachment_filename, attachment_subtype="octet-stream"):
     # Create the message
     message = MIMEMultipart()
     message['From'] = SENDER_EMAIL
@@ -306,140 +927,484 @@ async def send_email(subject, body, to_email, attachment_data, attachment_filena
     message.attach(MIMEText(body, 'plain'))
 
     # Attach the file
-    attachment = MIMEApplication(attachment_data)
+    attachment = MIMEApplication(attachment_data, attachment_subtype)
     attachment.add_header('Content-Disposition', 'attachment', filename=attachment_filename)
     message.attach(attachment)
 
-    try:
-        # Connect to the SMTP server
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            # Start the TLS connection
-            server.starttls()
+    return message
 
-            # Login to your Gmail account
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
+# Function to send email
+def send_email(subject, body, to_email, attachment_data, attachment_filename) -> str:
+    return queue_email(build_email(subject, body, to_email, attachment_data, attachment_filename))
+
+# Pass the request body through, rejecting it once it grows past the limit
+async def limited_body(request: Request, limit: int):
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {limit} bytes")
+        yield chunk
+
+# Check an uploaded CSV row by row without loading it, returning the number of data rows
+def count_csv_rows(file) -> int:
+    file.seek(0)
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if not header:
+            raise ValueError("CSV file has no header row")
+        rows = 0
+        for row in reader:
+            if row and len(row) != len(header):
+                raise ValueError(f"line {reader.line_num} has {len(row)} fields, expected {len(header)}")
+            rows += 1
+        return rows
+    finally:
+        text.detach()
+
+# Build the upload email from the spooled file, gzipping large attachments; runs on the mail sender's thread
+def build_upload_email(file, filename: str, rows: int):
+    file.seek(0, io.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    if size < UPLOAD_COMPRESS_MIN_BYTES:
+        data, subtype = file.read(), "octet-stream"
+    else:
+        compressor = zlib.compressobj(wbits=31)
+        parts = [compressor.compress(chunk) for chunk in iter(lambda: file.read(1024 * 1024), b"")]
+        parts.append(compressor.flush())
+        data, subtype = b"".join(parts), "gzip"
+    return build_email(subject="CSV File Uploaded",
+                       body=f"CSV file {filename} uploaded ({rows} rows).",
+                       to_email=RECIPIENT_EMAIL,
+                       attachment_data=data,
+                       attachment_filename=filename if subtype != "gzip" else filename + ".gz",
+                       attachment_subtype=subtype)
+
+UPLOAD_CSV_REQUEST_BODY = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"file": {"type": "string", "format": "binary"}},
+        "required": ["file"],
+    }}},
+}
 
-            # Send the email
-            server.sendmail(SENDER_EMAIL, to_email, message.as_string())
-        
-        # print("Email sent successfully!")
+# Endpoint to upload CSV file and send via email
+@app.post("/upload_csv/", status_code=202, openapi_extra={"requestBody": UPLOAD_CSV_REQUEST_BODY})
+async def upload_csv(request: Request):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
 
+    # The multipart parser streams the file part into a spooled temporary file
+    try:
+        form = await MultiPartParser(request.headers, limited_body(request, UPLOAD_MAX_BYTES), max_files=1).parse()
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error sending email: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid multipart upload: {e}")
+    upload = form.get("file")
+    if not isinstance(upload, UploadFile):
+        await form.close()
+        raise HTTPException(status_code=400, detail="Missing 'file' field")
 
-# Endpoint to upload CSV file and send via email
-@app.post("/upload_csv/")
-async def upload_csv(file: UploadFile = File(...)):
     try:
-        # Read the file content into memory
-        file_content = await file.read()
-
-        # Send email with attachment
-        await send_email(subject="CSV File Uploaded",
-                         body=f"CSV file {file.filename} uploaded.",
-                         to_email=RECIPIENT_EMAIL,
-                         attachment_data=file_content,
-                         attachment_filename=file.filename)
+        rows = await run_in_threadpool(count_csv_rows, upload.file)
+    except (ValueError, csv.Error) as e:
+        await form.close()
+        raise HTTPException(status_code=400, detail=f"Invalid CSV upload: {e}")
 
-        return {"message": f"File '{file.filename}' uploaded successfully and sent via email."}
+    # The mail sender reads the spooled file when it delivers the job and closes it afterwards
+    filename = upload.filename or "upload.csv"
+    job_id = queue_email(lambda: build_upload_email(upload.file, filename, rows), cleanup=upload.file.close)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading file and sending email: {e}")
+    return {"message": f"File '{filename}' uploaded successfully and queued for email.", "job_id": job_id, "rows": rows}
     
 # Endpoint to create the record
 @app.post("/records/")
-async def create_record(record: Record, db_pool = Depends(create_db_pool)):
+async def create_record(record: Record, db_pool = Depends(get_db_pool)):
     async with db_pool.acquire() as connection:
         try:
             parameters_json = json.dumps(record.parameters)
-            record_id = await connection.fetchval("INSERT INTO records (event_name, parameters) VALUES ($1, $2) RETURNING id",
-                                                  record.event_name, parameters_json)
-            return {"id": record_id, **record.dict()}
+            with time_query("create_record"):
+                created = await connection.fetchrow("INSERT INTO records (event_name, parameters) VALUES ($1, $2) RETURNING id, code",
+                                                    record.event_name, parameters_json)
+            invalidate_event_summary(record.event_name)
+            return {"id": created['id'], "code": created['code'], **record.dict()}
         except Exception as e:
-            print("Error:", e)
+            logger.exception("Failed to create record")
             raise HTTPException(status_code=500, detail="Failed to create record")
 
+# Parse an uploaded CSV (header row = parameter names) or NDJSON (one object per line) file
+def iter_import_rows(text, import_format: str):
+    if import_format == "csv":
+        reader = csv.DictReader(text)
+        if not reader.fieldnames:
+            raise ValueError("CSV file has no header row")
+        for row in reader:
+            if None in row:
+                raise ValueError(f"Line {reader.line_num}: more fields than the header")
+            yield row
+    else:
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ValueError(f"Line {line_number}: invalid JSON")
+            if not isinstance(row, dict):
+                raise ValueError(f"Line {line_number}: expected a JSON object")
+            yield row
+
+# Take the next chunk of rows, ready for COPY
+def next_import_chunk(rows, event_name: str, size: int):
+    chunk = []
+    for row in rows:
+        chunk.append((event_name, json.dumps(row)))
+        if len(chunk) >= size:
+            break
+    return chunk
+
+# Endpoint to bulk import records for an event from a CSV or NDJSON request body
+@app.post("/records/{event_name}/import")
+async def import_records(request: Request, event_name: str, format: Optional[str] = None, db_pool=Depends(get_db_pool)):
+    import_format = format or ("ndjson" if "ndjson" in request.headers.get("content-type", "") else "csv")
+    if import_format not in ["csv", "ndjson"]:
+        raise HTTPException(status_code=400, detail="Invalid format, expected 'csv' or 'ndjson'")
+
+    # Stream the body into a spooled file so large uploads never sit in memory whole
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MEMORY_BYTES) as spool:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > IMPORT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {IMPORT_MAX_BYTES} bytes")
+            spool.write(chunk)
+        spool.seek(0)
+
+        text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        rows = iter_import_rows(text, import_format)
+        imported = 0
+        async with db_pool.acquire() as connection:
+            try:
+                # All or nothing: a bad line aborts the whole import
+                async with connection.transaction():
+                    while True:
+                        chunk = await run_in_threadpool(next_import_chunk, rows, event_name, IMPORT_CHUNK_ROWS)
+                        if not chunk:
+                            break
+                        with time_query("import_copy"):
+                            await connection.copy_records_to_table("records", records=chunk, columns=["event_name", "parameters"])
+                        imported += len(chunk)
+                    # A long import commits rows whose updated_at is older than open pages' sync cursors,
+                    # so tell those pages to reload; the notification is only delivered if this commits
+                    with time_query("import_notify"):
+                        await connection.execute(
+                            "SELECT pg_notify($1, $2)", RECORD_CHANGES_CHANNEL,
+                            json.dumps({"op": "INSERT", "event_name": event_name, "code": None, "reload": True}))
+            except (ValueError, csv.Error) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid {import_format} upload: {e}")
+            except Exception as e:
+                logger.exception("Failed to import records")
+                raise HTTPException(status_code=500, detail="Failed to import records")
+        text.detach()
+
+    invalidate_event_summary(event_name)
+    return {"event_name": event_name, "imported": imported}
+
+# Endpoint to render the check-in page; rows are loaded by the page through the records API
 @app.post("/records/{event_name}/", response_class=HTMLResponse)
-async def read_records_by_event_name(request: Request, event_name: str, parameters: str = None, db_pool=Depends(create_db_pool)):
+async def read_records_by_event_name(request: Request, event_name: str, parameters: str = None, db_pool=Depends(get_db_pool)):
+    # Parse the parameters query parameter into a list
+    parameters_list = parameters.split(',') if parameters else None
+
     async with db_pool.acquire() as connection:
         try:
-            # Parse the parameters query parameter into a list
-            if parameters:
-                parameters_list = parameters.split(',')
-                parameters_keys = set(parameters_list)  # Initialize parameters_keys with parameters_list
-            else:
-                parameters_list = None
-                parameters_keys = set()
-
-            # Fetch records from the database
-            records = await connection.fetch(
-                "SELECT code, event_name, parameters, signed_in, signed_out FROM records WHERE event_name = $1", event_name)
-
-            # Convert each record to a dictionary and parse the 'parameters' field
-            parsed_records = []
-            for record in records:
-                record_dict = dict(record)
-                record_dict['parameters'] = json.loads(record['parameters'])
-                parsed_records.append(record_dict)
-                parameters_keys.update(record_dict['parameters'].keys())
-
-            # print(parsed_records)
-
-            # Filter parameters_keys based on the specified parameters_list
-            if parameters_list:
-                parameters_keys = [param for param in parameters_list if param in parameters_keys]
-
-            # Render the template with the data
-            return templates.TemplateResponse("records_template.html", {"request": request, "event_name": event_name, "records": parsed_records, "parameters_keys": parameters_keys, "parameters_list": parameters_list})
+            # Take the delta-sync cursor before the page loads any rows so later changes are not missed
+            with time_query("sync_cursor"):
+                sync_cursor = await connection.fetchval("SELECT clock_timestamp()")
+
+            with time_query("event_parameter_keys"):
+                if parameters_list:
+                    # Keep the requested columns, in order, that appear in at least one of the event's records
+                    rows = await connection.fetch("""
+                        SELECT key FROM unnest($2::text[]) WITH ORDINALITY AS requested(key, position)
+                        WHERE EXISTS (SELECT 1 FROM records WHERE event_name = $1 AND parameters ? key)
+                        ORDER BY position
+                    """, event_name, parameters_list)
+                else:
+                    rows = await connection.fetch(
+                        "SELECT DISTINCT jsonb_object_keys(parameters) AS key FROM records WHERE event_name = $1 ORDER BY key", event_name)
+            parameters_keys = [row['key'] for row in rows]
         except Exception as e:
-            print("Error:", e)
+            logger.exception("Failed to read records")
             raise HTTPException(status_code=500, detail="Failed to read records")
 
+    # Render the page shell; its size no longer depends on the number of records
+    return render_template("records_template.html", {"request": request, "event_name": event_name, "parameters_keys": parameters_keys, "page_size": RECORDS_PAGE_SIZE, "sync_cursor": sync_cursor.isoformat()})
+
+# A record as the API returns it, built by Postgres as JSON text so rows are never decoded and re-encoded in Python.
+# Form answers are merged last, so they win over column names as they did with the dict merge.
+RECORD_DOCUMENT = """(jsonb_build_object(
+    'id', id, 'event_name', event_name, 'created_at', created_at, 'code', code,
+    'signed_in', signed_in, 'signed_out', signed_out
+) || parameters)::text"""
+
+READ_RECORD_QUERY = f"SELECT {RECORD_DOCUMENT} FROM records WHERE code = $1"
+
+# Join JSON documents from Postgres into a JSON array
+def json_array(documents) -> bytes:
+    return b"[" + b",".join(document.encode() for document in documents) + b"]"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
 # Endpoint to read one record given its code
 @app.get("/record/{code}/")
-async def read_record(code: str, db_pool=Depends(create_db_pool)):
+async def read_record(request: Request, code: str, db_pool=Depends(get_db_pool)):
+    cached = record_cache.get(code)
+    if cached is None:
+        version = record_invalidation.version
+        async with db_pool.acquire() as connection:
+            try:
+                with time_query("read_record"):
+                    document = await connection.fetchval(READ_RECORD_QUERY, code)
+            except Exception as e:
+                logger.exception("Failed to read record")
+                raise HTTPException(status_code=500, detail="Failed to read record")
+        if document is None:
+            raise HTTPException(status_code=404, detail="Record not found")
+
+        body = document.encode()
+        cached = (body, '"' + hashlib.sha1(body).hexdigest() + '"')
+        if record_invalidation.version == version:
+            record_cache.set(code, cached)
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Build a keyset-paginated query over records, ordered by id
+def build_records_query(conditions: list, args: list, after: Optional[int] = None, limit: Optional[int] = None):
+    conditions = list(conditions)
+    args = list(args)
+    if after is not None:
+        args.append(after)
+        conditions.append(f"id > ${len(args)}")
+    query = f"SELECT id, {RECORD_DOCUMENT} AS document FROM records"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+    if limit is not None:
+        args.append(limit)
+        query += f" LIMIT ${len(args)}"
+    return query, args
+
+# Return one page of records, with the cursor for the next page in the X-Next-Cursor header
+async def fetch_records_page(db_pool, conditions: list, args: list, after: Optional[int], limit: int):
+    # Fetch one extra row to find out whether another page exists
+    query, query_args = build_records_query(conditions, args, after, limit + 1)
     async with db_pool.acquire() as connection:
         try:
-            record = await connection.fetchrow(
-                "SELECT event_name, parameters, code, created_at, signed_in, signed_out FROM records WHERE code = $1", code)
-            if record:
-                return {"code": code, "event_name": record['event_name'], "created_at": record['created_at'], "signed_in": record['signed_in'], "signed_out": record['signed_out'], **json.loads(record['parameters'])}
-            else:
-                raise HTTPException(status_code=404, detail="Record not found")
+            with time_query("list_records_page"):
+                records = await connection.fetch(query, *query_args)
         except Exception as e:
-            print("Error:", e)
-            raise HTTPException(status_code=500, detail="Failed to read record")
+            logger.exception("Failed to read records")
+            raise HTTPException(status_code=500, detail="Failed to read records")
 
-# Endpoint to read all records
+    page = records[:limit]
+    response = Response(content=json_array(record['document'] for record in page), media_type="application/json")
+    if len(records) > limit:
+        response.headers["X-Next-Cursor"] = str(page[-1]['id'])
+    return response
+
+# Stream every matching record from a server-side cursor as NDJSON or a JSON array
+def stream_records(db_pool, conditions: list, args: list, after: Optional[int], stream_format: str):
+    query, query_args = build_records_query(conditions, args, after)
+
+    async def generate():
+        async with db_pool.acquire() as connection:
+            # Server-side cursors only live inside a transaction
+            async with connection.transaction(readonly=True):
+                if stream_format == "json":
+                    yield b"["
+                first = True
+                with time_query("stream_records_open"):
+                    cursor = await connection.cursor(query, *query_args)
+                while True:
+                    # Time each fetch on its own so the time spent sending rows to the client is left out
+                    with time_query("stream_records_fetch"):
+                        batch = await cursor.fetch(RECORDS_STREAM_PREFETCH)
+                    if not batch:
+                        break
+                    for record in batch:
+                        row = record['document'].encode()
+                        if stream_format == "json":
+                            yield row if first else b"," + row
+                        else:
+                            yield row + b"\n"
+                        first = False
+                if stream_format == "json":
+                    yield b"]"
+
+    media_type = "application/json" if stream_format == "json" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type)
+
+# Validate the listing query parameters shared by the record list endpoints
+def check_stream_format(stream: Optional[str]):
+    if stream is not None and stream not in ["ndjson", "json"]:
+        raise HTTPException(status_code=400, detail="Invalid stream format, expected 'ndjson' or 'json'")
+
+# Endpoint to read all records, one page at a time or streamed
 @app.get("/records/")
-async def read_records(db_pool = Depends(create_db_pool)):
+async def read_records(after: Optional[int] = None, limit: int = Query(RECORDS_PAGE_SIZE, ge=1, le=RECORDS_MAX_PAGE_SIZE), stream: Optional[str] = None, db_pool = Depends(get_db_pool)):
+    check_stream_format(stream)
+    if stream:
+        return stream_records(db_pool, [], [], after, stream)
+    return await fetch_records_page(db_pool, [], [], after, limit)
+
+# Escape LIKE wildcards so user input is matched literally
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# Split "key:value" filter arguments into (key, value) pairs
+def parse_parameter_filters(filters: Optional[List[str]]):
+    pairs = []
+    for item in filters or []:
+        key, separator, value = item.partition(":")
+        if not separator or not key:
+            raise HTTPException(status_code=400, detail=f"Invalid filter '{item}', expected key:value")
+        pairs.append((key, value))
+    return pairs
+
+# Build the WHERE conditions for an event's records from the query filters
+def build_record_filters(event_name: str, code: Optional[str] = None, signed_in: Optional[bool] = None, signed_out: Optional[bool] = None, filters: Optional[List[str]] = None, matches: Optional[List[str]] = None):
+    conditions, args = ["event_name = $1"], [event_name]
+
+    def add_arg(value):
+        args.append(value)
+        return f"${len(args)}"
+
+    if code:
+        conditions.append(f"code ILIKE {add_arg('%' + escape_like(code) + '%')}")
+    if signed_in is not None:
+        conditions.append(f"COALESCE(signed_in, FALSE) = {add_arg(signed_in)}")
+    if signed_out is not None:
+        conditions.append(f"COALESCE(signed_out, FALSE) = {add_arg(signed_out)}")
+
+    # Substring match on a form answer
+    for key, value in parse_parameter_filters(filters):
+        pattern = add_arg('%' + escape_like(value) + '%')
+        conditions.append(f"parameters ->> {add_arg(key)} ILIKE {pattern}")
+        # Also match against the whole document so the trigram index can narrow the rows first.
+        # Values with quotes, backslashes or control characters are escaped in the text form, so skip those.
+        if value and not any(c in value for c in '"\\') and all(c >= " " for c in value):
+            conditions.append(f"parameters::text ILIKE {pattern}")
+
+    # Exact match on a form answer, served by the GIN index
+    for key, value in parse_parameter_filters(matches):
+        conditions.append(f"parameters @> {add_arg(json.dumps({key: value}))}::jsonb")
+
+    return conditions, args
+
+# Endpoint to query the records of one event, one page at a time or streamed
+# Filters: code (substring), signed_in, signed_out, filter=key:value (substring) and match=key:value (exact)
+@app.get("/records/{event_name}/")
+async def list_records_by_event_name(event_name: str, code: Optional[str] = None, signed_in: Optional[bool] = None, signed_out: Optional[bool] = None, filter: Optional[List[str]] = Query(None), match: Optional[List[str]] = Query(None), after: Optional[int] = None, limit: int = Query(RECORDS_PAGE_SIZE, ge=1, le=RECORDS_MAX_PAGE_SIZE), stream: Optional[str] = None, db_pool = Depends(get_db_pool)):
+    check_stream_format(stream)
+    conditions, args = build_record_filters(event_name, code, signed_in, signed_out, filter, match)
+    if stream:
+        return stream_records(db_pool, conditions, args, after, stream)
+    return await fetch_records_page(db_pool, conditions, args, after, limit)
+
+# Endpoint returning the records of an event created, updated or deleted since a cursor
+@app.get("/records/{event_name}/changes")
+async def read_record_changes(event_name: str, since: datetime, db_pool = Depends(get_db_pool)):
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    window_start = since - timedelta(seconds=CHANGES_CURSOR_OVERLAP_SECONDS)
+    # Deletions before the retention window may already be pruned, so the client has to reload
+    if window_start < datetime.now(timezone.utc) - timedelta(hours=RECORD_DELETIONS_RETENTION_HOURS):
+        async with db_pool.acquire() as connection:
+            with time_query("sync_cursor"):
+                cursor = await connection.fetchval("SELECT clock_timestamp()")
+        return ORJSONResponse(status_code=410, content={"detail": "Sync cursor is too old, reload the records", "cursor": cursor.isoformat()})
     async with db_pool.acquire() as connection:
         try:
-            records = await connection.fetch("SELECT id, event_name, parameters, code, created_at, signed_in, signed_out FROM records")
-            return [{"id": record['id'], "event_name": record['event_name'], "created_at": record['created_at'], "code": record['code'], "signed_in": record['signed_in'], "signed_out": record['signed_out'], **json.loads(record['parameters'])}
-                    for record in records]
+            # Read both tables from one snapshot
+            with time_query("record_changes"):
+                async with connection.transaction(isolation="repeatable_read", readonly=True):
+                    cursor = await connection.fetchval("SELECT clock_timestamp()")
+                    records = await connection.fetch(
+                        f"SELECT {RECORD_DOCUMENT} AS document FROM records WHERE event_name = $1 AND updated_at > $2 ORDER BY updated_at",
+                        event_name, window_start)
+                    deleted = await connection.fetch(
+                        "SELECT DISTINCT code FROM record_deletions WHERE event_name = $1 AND deleted_at > $2 AND code IS NOT NULL",
+                        event_name, window_start)
         except Exception as e:
-            print("Error:", e)
-            raise HTTPException(status_code=500, detail="Failed to read records")
+            logger.exception("Failed to read record changes")
+            raise HTTPException(status_code=500, detail="Failed to read record changes")
+
+    body = b"".join((
+        b'{"cursor":', orjson.dumps(cursor),
+        b',"upserts":', json_array(record['document'] for record in records),
+        b',"deleted":', orjson.dumps([record['code'] for record in deleted]),
+        b"}",
+    ))
+    return Response(content=body, media_type="application/json")
+
+# Endpoint pushing live record changes for an event as server-sent events
+@app.get("/records/{event_name}/events")
+async def stream_record_events(event_name: str):
+    async def generate():
+        queue = record_change_hub.subscribe(event_name)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    change = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keep proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                yield b"data: " + orjson.dumps(change) + b"\n\n"
+        finally:
+            record_change_hub.unsubscribe(event_name, queue)
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Endpoint to update a record
 @app.put("/record/{code}/")
-async def update_record(code: str, record: Record, signed_in: Optional[bool] = None, signed_out: Optional[bool] = None, db_pool=Depends(create_db_pool)):
+async def update_record(code: str, record: Record, signed_in: Optional[bool] = None, signed_out: Optional[bool] = None, db_pool=Depends(get_db_pool)):
     async with db_pool.acquire() as connection:
         try:
             parameters_json = json.dumps(record.parameters)
             # Modify the SQL query to update all columns based on the code
-            await connection.execute(
-                "UPDATE records SET event_name = $1, parameters = $2, signed_in = $3, signed_out = $4 WHERE code = $5",
-                record.event_name, parameters_json, signed_in, signed_out, code)
+            with time_query("update_record"):
+                await connection.execute(
+                    "UPDATE records SET event_name = $1, parameters = $2, signed_in = $3, signed_out = $4 WHERE code = $5",
+                    record.event_name, parameters_json, signed_in, signed_out, code)
+            record_invalidation.invalidate(code)
+            invalidate_event_summary(record.event_name)
             return {"code": code, **record.dict()}
         except Exception as e:
-            print("Error:", e)
+            logger.exception("Failed to update record")
             raise HTTPException(status_code=500, detail="Failed to update record")
         
+UPDATE_STATUS_QUERY = "UPDATE records SET {} = $1 WHERE code = $2 RETURNING event_name"
+
 # New endpoint to update signed_in or signed_out boolean columns
 @app.put("/record/{code}/update_status/")
-async def update_status(code: str, column: str, status: bool, db_pool=Depends(create_db_pool)):
+async def update_status(code: str, column: str, status: bool, db_pool=Depends(get_db_pool)):
     # Validate the column name
     if column not in ["signed_in", "signed_out"]:
         raise HTTPException(status_code=400, detail="Invalid column name")
@@ -447,41 +1412,133 @@ async def update_status(code: str, column: str, status: bool, db_pool=Depends(cr
     async with db_pool.acquire() as connection:
         try:
             # Construct the SQL query with placeholders
-            query = "UPDATE records SET {} = $1 WHERE code = $2".format(column)
-            await connection.execute(query, status, code)
+            query = UPDATE_STATUS_QUERY.format(column)
+            with time_query("update_status"):
+                event_name = await connection.fetchval(query, status, code)
+            record_invalidation.invalidate(code)
+            invalidate_event_summary(event_name)
             return {"message": "{} updated successfully for record {}".format(column, code)}
         except Exception as e:
-            print("Error:", e)
+            logger.exception("Failed to update column")
             raise HTTPException(status_code=500, detail="Failed to update column")
 
+# Endpoint to apply many signed_in / signed_out updates in one transaction
+@app.put("/records/status/batch/")
+async def update_status_batch(updates: List[StatusUpdate], db_pool=Depends(get_db_pool)):
+    if len(updates) > STATUS_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {STATUS_BATCH_MAX_SIZE} updates per batch")
+
+    # Later operations on the same code and column win, as if applied one by one
+    values_by_column = {"signed_in": {}, "signed_out": {}}
+    for update in updates:
+        if update.column in values_by_column:
+            values_by_column[update.column][update.code] = update.value
+
+    updated_by_column = {}
+    event_names = set()
+    async with db_pool.acquire() as connection:
+        try:
+            with time_query("update_status_batch"):
+                async with connection.transaction():
+                    for column, values in values_by_column.items():
+                        if not values:
+                            continue
+                        rows = await connection.fetch(
+                            "UPDATE records AS r SET {} = u.value FROM unnest($1::text[], $2::bool[]) AS u(code, value) "
+                            "WHERE r.code = u.code RETURNING r.code, r.event_name".format(column),
+                            list(values.keys()), list(values.values()))
+                        updated_by_column[column] = {row['code'] for row in rows}
+                        event_names.update(row['event_name'] for row in rows)
+        except Exception as e:
+            logger.exception("Failed to update columns")
+            raise HTTPException(status_code=500, detail="Failed to update columns")
+
+    # Invalidate only after COMMIT so a concurrent read cannot cache the old rows
+    for code in set().union(*updated_by_column.values()):
+        record_invalidation.invalidate(code)
+    for event_name in event_names:
+        invalidate_event_summary(event_name)
+
+    results = []
+    for update in updates:
+        if update.column not in values_by_column:
+            status = "invalid_column"
+        elif update.code in updated_by_column.get(update.column, ()):
+            status = "updated"
+        else:
+            status = "not_found"
+        results.append({"code": update.code, "column": update.column, "value": update.value, "status": status})
+    return {"results": results}
+
 # Endpoint to delete a record
 @app.delete("/record/{code}/")
-async def delete_record(code: str, db_pool=Depends(create_db_pool)):
+async def delete_record(code: str, db_pool=Depends(get_db_pool)):
+    async with db_pool.acquire() as connection:
+        try:
+            with time_query("delete_record"):
+                event_name = await connection.fetchval("DELETE FROM records WHERE code = $1 RETURNING event_name", code)
+        except Exception as e:
+            logger.exception("Failed to delete record")
+            raise HTTPException(status_code=500, detail="Failed to delete record")
+    if event_name is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+
+    record_invalidation.invalidate(code)
+    invalidate_event_summary(event_name)
+    return {"message": "Record deleted successfully"}
+
+# Endpoint returning total, signed-in and signed-out counts for an event, optionally broken down by a form answer
+@app.get("/records/{event_name}/summary")
+async def read_records_summary(event_name: str, by: Optional[str] = None, db_pool=Depends(get_db_pool)):
+    cached = summary_cache.get(event_name)
+    if cached is not None and by in cached:
+        return cached[by]
+
+    version = summary_version
     async with db_pool.acquire() as connection:
         try:
-            # Check if the record exists before deleting it
-            existing_record = await connection.fetchval(
-                "SELECT 1 FROM records WHERE code = $1", code)
-            if existing_record is not None:
-                await connection.execute("DELETE FROM records WHERE code = $1", code)
-                return {"message": "Record deleted successfully"}
-            else:
-                raise HTTPException(status_code=404, detail="Record not found")
+            with time_query("event_summary"):
+                counts = await connection.fetchrow("""
+                    SELECT count(*) AS total,
+                           count(*) FILTER (WHERE signed_in) AS signed_in,
+                           count(*) FILTER (WHERE signed_out) AS signed_out
+                    FROM records WHERE event_name = $1
+                """, event_name)
+                summary = {"event_name": event_name, **dict(counts)}
+                if by is not None:
+                    rows = await connection.fetch("""
+                        SELECT parameters ->> $2 AS value,
+                               count(*) AS total,
+                               count(*) FILTER (WHERE signed_in) AS signed_in,
+                               count(*) FILTER (WHERE signed_out) AS signed_out
+                        FROM records WHERE event_name = $1
+                        GROUP BY 1 ORDER BY 1
+                    """, event_name, by)
+                    summary["breakdown"] = {"key": by, "values": [dict(row) for row in rows]}
         except Exception as e:
-            print("Error:", e)
-            raise HTTPException(status_code=500, detail=f"Failed to delete record")
-
-# Register the database connection pool creation as a startup event handler
-app.add_event_handler("startup", create_db_pool)
-
-# Endpoint to read all records for a given event name
-# @app.get("/records/{event_name}/")
-# async def read_records_by_event_name(event_name: str, db_pool = Depends(create_db_pool)):
-#     async with db_pool.acquire() as connection:
-#         try:
-#             records = await connection.fetch(
-#                 "SELECT id, parameters, code, created_at, signed_in, signed_out FROM records WHERE event_name = $1", event_name)
-#             return [{"id": record['id'], "created_at": record['created_at'], "code": record['code'], "signed_in": record['signed_in'], "signed_out": record['signed_out'], **json.loads(record['parameters'])} for record in records]
-#         except Exception as e:
-#             print("Error:", e)
-#             raise HTTPException(status_code=500, detail="Failed to read records")
+            logger.exception("Failed to read summary")
+            raise HTTPException(status_code=500, detail="Failed to read summary")
+
+    if summary_version == version:
+        cached = summary_cache.get(event_name)
+        if cached is None:
+            cached = {}
+            summary_cache.set(event_name, cached)
+        cached[by] = summary
+    return summary
+
+# Endpoint exposing Prometheus metrics
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+# Endpoint exposing in-process cache counters
+@app.get("/cache/stats/")
+async def cache_stats():
+    return {"records": record_cache.stats(), "summaries": summary_cache.stats(), "tokens": token_cache.stats()}
+
+# Endpoint exposing live connection pool stats
+@app.get("/pool/stats/")
+async def pool_stats(db_pool=Depends(get_db_pool)):
+    return db_pool.stats()
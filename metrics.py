@@ -0,0 +1,50 @@
+import os
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# With several worker processes, each writes its samples to PROMETHEUS_MULTIPROC_DIR and /metrics merges them
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time until the response starts, by route",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter("http_requests_total", "Requests by route and status code", ["method", "route", "status"])
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled", multiprocess_mode="livesum")
+
+QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Database query time by query label", ["query"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+TEMPLATE_RENDER_LATENCY = Histogram("template_render_duration_seconds", "Jinja template render time", ["template"])
+EMAIL_SEND_LATENCY = Histogram("email_send_duration_seconds", "SMTP delivery time per message", ["outcome"])
+
+DB_POOL_SIZE = Gauge("db_pool_size", "Open connections in the pool", multiprocess_mode="livesum")
+DB_POOL_IDLE = Gauge("db_pool_idle", "Idle connections in the pool", multiprocess_mode="livesum")
+DB_POOL_WAITERS = Gauge("db_pool_waiters", "Requests waiting for a pool connection", multiprocess_mode="livesum")
+DB_POOL_ACQUIRE_LATENCY = Histogram(
+    "db_pool_acquire_duration_seconds", "Time spent waiting for a pool connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+
+@contextmanager
+def time_query(label: str):
+    with QUERY_LATENCY.labels(label).time():
+        yield
+
+
+def observe_request(method: str, route: str, status: int, duration: float):
+    REQUEST_LATENCY.labels(method, route).observe(duration)
+    REQUESTS.labels(method, route, str(status)).inc()
+
+
+def render_metrics():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
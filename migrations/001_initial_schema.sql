@@ -0,0 +1,19 @@
+-- Base tables used by the application. Existing databases already have
+-- these, so every statement is a no-op there.
+CREATE TABLE IF NOT EXISTS records (
+    id SERIAL PRIMARY KEY,
+    event_name TEXT NOT NULL,
+    parameters JSON NOT NULL DEFAULT '{}',
+    code TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    signed_in BOOLEAN DEFAULT FALSE,
+    signed_out BOOLEAN DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS event_staff (
+    id SERIAL PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL,
+    event_name TEXT,
+    specified_columns TEXT
+);
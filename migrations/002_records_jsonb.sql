@@ -0,0 +1,40 @@
+-- Store form answers as jsonb so they can be indexed and filtered in SQL.
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'records' AND column_name = 'parameters') <> 'jsonb' THEN
+        ALTER TABLE records ALTER COLUMN parameters TYPE jsonb USING parameters::jsonb;
+    END IF;
+END
+$$;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Key existence (?) and containment (@>) lookups on form answers
+CREATE INDEX IF NOT EXISTS records_parameters_gin ON records USING gin (parameters);
+
+-- Event listings and per-event code lookups
+CREATE INDEX IF NOT EXISTS records_event_name_code_idx ON records (event_name, code);
+
+-- Older update_codes runs built codes with LPAD(id::TEXT, 4, '0'), which truncates ids of 10000 and up
+-- (10000-10009 all became <event>-1000). Give those rows their untruncated code before codes must be unique.
+UPDATE records SET code = event_name || '-' || id::TEXT
+WHERE id >= 10000 AND code = event_name || '-' || LPAD(id::TEXT, 4, '0');
+
+DO $$
+DECLARE
+    duplicate TEXT;
+BEGIN
+    SELECT code INTO duplicate FROM records WHERE code IS NOT NULL GROUP BY code HAVING count(*) > 1 LIMIT 1;
+    IF duplicate IS NOT NULL THEN
+        RAISE EXCEPTION 'records.code has duplicate values (e.g. %); make codes unique before running this migration', duplicate;
+    END IF;
+END
+$$;
+
+-- Badge lookups by code
+CREATE UNIQUE INDEX IF NOT EXISTS records_code_key ON records (code);
+
+-- Substring search on codes and on form answers
+CREATE INDEX IF NOT EXISTS records_code_trgm ON records USING gin (code gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS records_parameters_trgm ON records USING gin ((parameters::text) gin_trgm_ops);
@@ -0,0 +1,40 @@
+-- Track when each record last changed so clients can sync deltas.
+ALTER TABLE records ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS records_event_name_updated_at_idx ON records (event_name, updated_at);
+
+CREATE OR REPLACE FUNCTION records_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS records_touch_updated_at ON records;
+CREATE TRIGGER records_touch_updated_at
+    BEFORE INSERT OR UPDATE ON records
+    FOR EACH ROW EXECUTE FUNCTION records_touch_updated_at();
+
+-- Tombstones for rows that left an event, either deleted or moved to another event
+CREATE TABLE IF NOT EXISTS record_deletions (
+    code TEXT,
+    event_name TEXT NOT NULL,
+    deleted_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS record_deletions_event_name_deleted_at_idx ON record_deletions (event_name, deleted_at);
+
+CREATE OR REPLACE FUNCTION records_log_deletion() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' OR OLD.event_name IS DISTINCT FROM NEW.event_name
+            OR OLD.code IS DISTINCT FROM NEW.code THEN
+        INSERT INTO record_deletions (code, event_name) VALUES (OLD.code, OLD.event_name);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS records_log_deletion ON records;
+CREATE TRIGGER records_log_deletion
+    AFTER DELETE OR UPDATE OF event_name, code ON records
+    FOR EACH ROW EXECUTE FUNCTION records_log_deletion();
@@ -0,0 +1,49 @@
+-- Publish record changes on the records_changes channel for live check-in pages.
+-- Payloads stay small (no form answers) to keep well under the 8000 byte NOTIFY limit.
+CREATE OR REPLACE FUNCTION records_notify_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('records_changes', json_build_object(
+            'op', 'DELETE', 'event_name', OLD.event_name, 'code', OLD.code)::text);
+        RETURN NULL;
+    END IF;
+
+    IF OLD.event_name IS DISTINCT FROM NEW.event_name OR OLD.code IS DISTINCT FROM NEW.code THEN
+        -- The row left its old event or code; pages showing it must drop it
+        PERFORM pg_notify('records_changes', json_build_object(
+            'op', 'DELETE', 'event_name', OLD.event_name, 'code', OLD.code)::text);
+        PERFORM pg_notify('records_changes', json_build_object(
+            'op', 'INSERT', 'event_name', NEW.event_name, 'code', NEW.code)::text);
+    ELSE
+        PERFORM pg_notify('records_changes', json_build_object(
+            'op', 'UPDATE', 'event_name', NEW.event_name, 'code', NEW.code,
+            'signed_in', NEW.signed_in, 'signed_out', NEW.signed_out,
+            'parameters_changed', OLD.parameters IS DISTINCT FROM NEW.parameters)::text);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS records_notify_change ON records;
+CREATE TRIGGER records_notify_change
+    AFTER UPDATE OR DELETE ON records
+    FOR EACH ROW EXECUTE FUNCTION records_notify_change();
+
+-- Inserts often arrive in bulk, so send one notification per event per statement
+CREATE OR REPLACE FUNCTION records_notify_insert() RETURNS trigger AS $$
+DECLARE
+    inserted_event TEXT;
+BEGIN
+    FOR inserted_event IN SELECT DISTINCT event_name FROM inserted LOOP
+        PERFORM pg_notify('records_changes', json_build_object(
+            'op', 'INSERT', 'event_name', inserted_event, 'code', NULL)::text);
+    END LOOP;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS records_notify_insert ON records;
+CREATE TRIGGER records_notify_insert
+    AFTER INSERT ON records
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION records_notify_insert();
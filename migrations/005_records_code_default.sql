@@ -0,0 +1,17 @@
+-- Assign codes when rows are inserted instead of rewriting the whole table afterwards.
+-- Ids are padded to at least four digits; LPAD alone would truncate longer ids and make codes collide.
+CREATE OR REPLACE FUNCTION records_assign_code() RETURNS trigger AS $$
+BEGIN
+    IF NEW.code IS NULL THEN
+        NEW.code := NEW.event_name || '-' || LPAD(NEW.id::TEXT, GREATEST(4, length(NEW.id::TEXT)), '0');
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS records_assign_code ON records;
+CREATE TRIGGER records_assign_code
+    BEFORE INSERT ON records
+    FOR EACH ROW EXECUTE FUNCTION records_assign_code();
+
+UPDATE records SET code = event_name || '-' || LPAD(id::TEXT, GREATEST(4, length(id::TEXT)), '0') WHERE code IS NULL;
@@ -0,0 +1,18 @@
+-- Rows without a code were never visible to the check-in page, so they need no tombstone.
+CREATE OR REPLACE FUNCTION records_log_deletion() RETURNS trigger AS $$
+BEGIN
+    IF OLD.code IS NULL THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' OR OLD.event_name IS DISTINCT FROM NEW.event_name
+            OR OLD.code IS DISTINCT FROM NEW.code THEN
+        INSERT INTO record_deletions (code, event_name) VALUES (OLD.code, OLD.event_name);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DELETE FROM record_deletions WHERE code IS NULL;
+
+-- Old tombstones are pruned by age
+CREATE INDEX IF NOT EXISTS record_deletions_deleted_at_idx ON record_deletions (deleted_at);
@@ -0,0 +1,105 @@
+"""Production entry point: several worker processes behind one listening socket.
+
+Runs gunicorn with uvicorn workers, or uvicorn's own process manager where
+gunicorn is not available (e.g. Windows).
+
+    python serve.py
+
+On SIGTERM the server stops accepting connections and gives in-flight requests
+up to DRAIN_TIMEOUT seconds to finish. Connections still open after that, such
+as live-update streams, are cancelled. Each worker then runs the app's shutdown:
+queued mail is drained and the database pools are closed. All of this has to
+fit in GRACEFUL_TIMEOUT, after which gunicorn kills the worker.
+"""
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# One event loop per core; each worker opens its own pool of up to DB_POOL_MAX_SIZE connections
+WORKERS = int(os.getenv("WEB_CONCURRENCY", str(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Leave the rest of GRACEFUL_TIMEOUT for the mail queue drain and closing the pools
+MAIL_SHUTDOWN_TIMEOUT = float(os.getenv("MAIL_SHUTDOWN_TIMEOUT", "10"))
+DRAIN_TIMEOUT = int(os.getenv("DRAIN_TIMEOUT", str(max(1, GRACEFUL_TIMEOUT - int(MAIL_SHUTDOWN_TIMEOUT) - 5))))
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "60"))
+KEEPALIVE = int(os.getenv("KEEPALIVE", "5"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").lower()
+
+
+def prepare_metrics_dir():
+    # Workers must share a metrics directory so /metrics reports all of them
+    if WORKERS > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="forms-metrics-")
+
+
+def child_exit(server, worker):
+    # Drop the gauges of a worker that has gone away
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+
+    class Worker(UvicornWorker):
+        # UvicornWorker waits for open connections without a limit, so SSE streams would block shutdown
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "timeout_graceful_shutdown": DRAIN_TIMEOUT}
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                "bind": f"{HOST}:{PORT}",
+                "workers": WORKERS,
+                "worker_class": Worker,
+                "graceful_timeout": GRACEFUL_TIMEOUT,
+                "timeout": WORKER_TIMEOUT,
+                "keepalive": KEEPALIVE,
+                "loglevel": LOG_LEVEL,
+                "accesslog": None,
+                "child_exit": child_exit,
+                # Each worker imports the app itself so pools and background tasks are created after the fork
+                "preload_app": False,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    Server().run()
+
+
+def run_uvicorn():
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        timeout_keep_alive=KEEPALIVE,
+        timeout_graceful_shutdown=DRAIN_TIMEOUT,
+        log_level=LOG_LEVEL,
+        access_log=False,
+    )
+
+
+def main():
+    prepare_metrics_dir()
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        run_uvicorn()
+    else:
+        run_gunicorn()
+
+
+if __name__ == "__main__":
+    main()
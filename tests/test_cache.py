@@ -0,0 +1,162 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+from cache import LRUCache  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    lru = LRUCache(maxsize=10, ttl=5)
+    lru.set("a", 1)
+    lru.set("b", 2, ttl=60)
+
+    clock.now += 4
+    assert lru.get("a") == 1
+    clock.now += 1
+    assert lru.get("a") is None
+    assert lru.get("b") == 2
+    assert lru.stats()["expirations"] == 1
+    assert len(lru) == 1
+
+
+def test_evicts_least_recently_used(clock):
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    # Reading "a" makes "b" the least recently used entry
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+
+
+def test_counts_hits_misses_and_evictions(clock):
+    lru = LRUCache(maxsize=1, ttl=60)
+    lru.set("a", 1)
+    lru.get("a")
+    lru.get("missing")
+    lru.set("b", 2)
+
+    stats = lru.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 1, 1)
+    assert (stats["size"], stats["maxsize"]) == (1, 1)
+
+
+def test_pop_and_clear(clock):
+    lru = LRUCache(maxsize=10, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+
+    assert lru.pop("a") == 1
+    assert lru.pop("a", "gone") == "gone"
+    lru.clear()
+    assert len(lru) == 0
+
+
+main = pytest.importorskip("main")
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", W/"abc"', True),
+    ('"xyz",W/"other"', False),
+    ("*", True),
+    ('"abcd"', False),
+])
+def test_etag_matches(header, expected):
+    assert main.etag_matches(header, '"abc"') is expected
+
+
+def test_local_invalidation_drops_entry_and_bumps_version():
+    lru = LRUCache(maxsize=10, ttl=60)
+    invalidation = main.LocalRecordInvalidation(lru)
+    lru.set("A-0001", "cached")
+
+    invalidation.invalidate("A-0001")
+    assert lru.get("A-0001") is None
+    assert invalidation.version == 1
+
+    lru.set("A-0002", "cached")
+    invalidation.clear()
+    assert len(lru) == 0
+    assert invalidation.version == 2
+
+
+class FakeConnection:
+    def __init__(self, document, during_query=None):
+        self.document = document
+        self.during_query = during_query
+
+    async def fetchval(self, query, *args):
+        if self.during_query is not None:
+            self.during_query()
+        return self.document
+
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.connection
+
+
+def make_request(headers=()):
+    from starlette.requests import Request
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": list(headers)})
+
+
+@pytest.fixture
+def record_cache():
+    main.record_cache.clear()
+    yield main.record_cache
+    main.record_cache.clear()
+
+
+def test_read_record_caches_body_and_answers_304(record_cache):
+    pool = FakePool(FakeConnection('{"code": "A-0001"}'))
+
+    response = asyncio.run(main.read_record(make_request(), "A-0001", db_pool=pool))
+    assert response.status_code == 200
+    assert response.body == b'{"code": "A-0001"}'
+    assert record_cache.get("A-0001") is not None
+
+    etag = response.headers["etag"]
+    response = asyncio.run(main.read_record(make_request([(b"if-none-match", etag.encode())]), "A-0001", db_pool=pool))
+    assert response.status_code == 304
+
+
+def test_read_record_skips_cache_when_invalidated_during_lookup(record_cache):
+    # A write lands while the lookup is in flight, so the row read may already be stale
+    pool = FakePool(FakeConnection('{"code": "A-0001"}', during_query=lambda: main.record_invalidation.invalidate("A-0001")))
+
+    response = asyncio.run(main.read_record(make_request(), "A-0001", db_pool=pool))
+    assert response.status_code == 200
+    assert record_cache.get("A-0001") is None
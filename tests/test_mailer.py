@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sys
+from email.message import EmailMessage
+
+import pytest
+
+pytest.importorskip("aiosmtplib")
+pytest.importorskip("prometheus_client")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailer import MailDispatcher  # noqa: E402
+
+
+class StubSMTP:
+    """Stands in for an aiosmtplib session, rejecting messages the way aiosmtplib does."""
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.is_connected = True
+
+    async def send_message(self, message):
+        if message["From"] is None:
+            raise ValueError("No From header provided in message")
+        self.sent.append(message)
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+def make_message(sender="staff@example.com"):
+    message = EmailMessage()
+    if sender is not None:
+        message["From"] = sender
+    message["To"] = "guest@example.com"
+    message["Subject"] = "Your OTP Code"
+    message.set_content("Your OTP code is: 1234")
+    return message
+
+
+async def run_dispatcher(messages, senders=1):
+    sent = []
+    connections = []
+    dispatcher = MailDispatcher("localhost", 25, senders=senders, retry_base_delay=0)
+
+    async def connect():
+        smtp = StubSMTP(sent)
+        connections.append(smtp)
+        return smtp
+
+    dispatcher._connect = connect
+    await dispatcher.start()
+    job_ids = [dispatcher.submit(message) for message in messages]
+    await asyncio.wait_for(dispatcher.queue.join(), 5)
+    jobs = [dispatcher.get_job(job_id) for job_id in job_ids]
+    await dispatcher.stop(timeout=1)
+    return jobs, sent, connections
+
+
+def test_delivers_over_one_session():
+    jobs, sent, connections = asyncio.run(run_dispatcher([make_message(), make_message()]))
+
+    assert [job.status for job in jobs] == ["sent", "sent"]
+    assert all(job.message is None for job in jobs)
+    assert len(sent) == 2
+    assert len(connections) == 1
+
+
+def test_unsendable_message_fails_without_stopping_the_sender():
+    jobs, sent, _ = asyncio.run(run_dispatcher([make_message(sender=None), make_message()]))
+
+    assert jobs[0].status == "failed"
+    assert "From" in jobs[0].error
+    assert jobs[1].status == "sent"
+    assert len(sent) == 1
+
+
+def test_cleanup_runs_once_the_job_is_done():
+    cleaned = []
+
+    async def scenario():
+        dispatcher = MailDispatcher("localhost", 25, senders=1)
+        sent = []
+
+        async def connect():
+            return StubSMTP(sent)
+
+        dispatcher._connect = connect
+        await dispatcher.start()
+        job_id = dispatcher.submit(make_message, cleanup=lambda: cleaned.append(True))
+        await asyncio.wait_for(dispatcher.queue.join(), 5)
+        job = dispatcher.get_job(job_id)
+        await dispatcher.stop(timeout=1)
+        return job, sent
+
+    job, sent = asyncio.run(scenario())
+
+    assert job.status == "sent"
+    assert len(sent) == 1
+    assert cleaned == [True]
+    assert job.message is None